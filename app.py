@@ -1,131 +1,236 @@
 import argparse
+import ast
 import asyncio
 import signal
-from typing import List, Dict
-from bleak import BleakScanner, BleakClient
+import sys
+from functools import partial
+from typing import List, Optional, Set, Tuple
+from bleak import BleakClient
+from bleak.backends.characteristic import BleakGATTCharacteristic
 from bleak.backends.device import BLEDevice
+from bleak.backends.service import BleakGATTServiceCollection
+from ble_utils import get_runner, read_input, scan_and_list
 
 # A global event to signal shutdown
 shutdown_event = asyncio.Event()
 
-async def graceful_shutdown(sig: signal.Signals, loop: asyncio.AbstractEventLoop):
-    """Sets the shutdown event and cancels running tasks."""
+# Tasks started by this script, so shutdown only has to cancel what it owns
+_owned_tasks: Set[asyncio.Task] = set()
+
+# Properties that make a characteristic worth listing
+RW_PROPS = frozenset(('read', 'write', 'write-without-response'))
+
+HELP_TEXT = (
+    "Commands: read <num> | write <num> <value> | list | quit\n"
+    "  <value> can be text (e.g., 'hello'), hex (e.g., '0x01af') or a bytes literal (e.g., b'\\x01\\x02')"
+)
+
+# A numbered characteristic together with its pre-formatted properties
+CharEntry = Tuple[BleakGATTCharacteristic, str]
+
+def build_char_map(services: BleakGATTServiceCollection, verbose: bool) -> List[CharEntry]:
+    """Prints the service list and maps characteristics to a number for easy interaction."""
+    # Index 0 is unused so the user-facing numbering stays 1-based
+    char_map: List[CharEntry] = [None]
+    # Collect the listing and write it in one go rather than one print per line
+    lines: List[str] = []
+
+    for service in services:
+        # Filter for characteristics that are readable or writable
+        has_rw = any(not RW_PROPS.isdisjoint(c.properties) for c in service.characteristics)
+        if has_rw or verbose:
+            lines.append(f"\n[Service] {service.uuid}")
+            for char in service.characteristics:
+                # Format the properties once so 'list' can reuse them
+                props = ", ".join(char.properties)
+                lines.append(f"  {len(char_map)}: {char.uuid} ({props})")
+                char_map.append((char, props))
+
+    write_lines(lines)
+    return char_map
+
+def print_char_map(char_map: List[CharEntry]):
+    """Reprints the numbered characteristics under their services; services without any are skipped."""
+    lines: List[str] = []
+    service_handle = None
+    for index, (char, props) in enumerate(char_map[1:], start=1):
+        if char.service_handle != service_handle:
+            service_handle = char.service_handle
+            lines.append(f"\n[Service] {char.service_uuid}")
+        lines.append(f"  {index}: {char.uuid} ({props})")
+    write_lines(lines)
+
+def write_lines(lines: List[str]):
+    """Writes a listing to stdout with a single call."""
+    if lines:
+        sys.stdout.write("\n".join(lines))
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+def spawn_owned_task(loop: asyncio.AbstractEventLoop, coro) -> asyncio.Task:
+    """Creates a task and tracks it until it finishes."""
+    task = loop.create_task(coro)
+    _owned_tasks.add(task)
+    task.add_done_callback(_owned_tasks.discard)
+    return task
+
+def _sched_shutdown(sig: signal.Signals, loop: asyncio.AbstractEventLoop):
+    """Signal handler that schedules graceful_shutdown on the loop."""
+    spawn_owned_task(loop, graceful_shutdown(sig))
+
+async def graceful_shutdown(sig: signal.Signals):
+    """Sets the shutdown event and cancels the tasks we own."""
     print(f"\nReceived exit signal {sig.name}, shutting down...")
     shutdown_event.set()
     
-    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    tasks = _owned_tasks - {asyncio.current_task()}
     for task in tasks:
         task.cancel()
     
-    await asyncio.gather(*tasks, return_exceptions=True)
-    if loop.is_running():
-        loop.stop()
+    if tasks:
+        await asyncio.wait(tasks, return_when=asyncio.ALL_COMPLETED)
 
 async def select_device(verbose: bool) -> BLEDevice:
     """Scans for devices and prompts the user to select one."""
-    print("Scanning for devices...")
-    devices = await BleakScanner.discover(timeout=5.0)
-    
-    # Filter for devices with a name and create a numbered list
-    named_devices: List[BLEDevice] = [d for d in devices if d.name]
-    if not named_devices:
-        print("No named devices found. Try again or check BLE device visibility.")
-        return None
-
-    print("Please select a device:")
-    for i, device in enumerate(named_devices):
-        print(f"  {i}: {device.name} ({device.address})")
-        if verbose:
-            print(f"     Details: {device.details}")
-
     while not shutdown_event.is_set():
-        try:
-            # Use asyncio.to_thread to run blocking 'input' without blocking the event loop
-            selection = await asyncio.to_thread(input, "Enter number, 's' to scan again, or 'q' to quit: ")
-            if selection.lower() == 'q':
-                return None
-            if selection.lower() == 's':
-                return await select_device(verbose) # Recursive call to rescan
-            
-            device_index = int(selection)
-            if 0 <= device_index < len(named_devices):
-                return named_devices[device_index]
-            else:
-                print("Invalid number, please try again.")
-        except ValueError:
-            print("Invalid input, please enter a number.")
-        except asyncio.CancelledError:
-            break # Exit if the task is cancelled
+        print("Scanning for devices...")
+        # Only devices with a name are collected, deduplicated by address
+        named_devices = await scan_and_list(timeout=5.0, idle_timeout=1.5)
+        if not named_devices:
+            print("No named devices found. Try again or check BLE device visibility.")
+            return None
+
+        print("Please select a device:")
+        for i, device in enumerate(named_devices):
+            print(f"  {i}: {device.name} ({device.address})")
+            if verbose:
+                print(f"     Details: {device.details}")
+
+        while not shutdown_event.is_set():
+            try:
+                selection = await read_input("Enter number, 's' to scan again, or 'q' to quit: ")
+                if selection.lower() == 'q':
+                    return None
+                if selection.lower() == 's':
+                    break # Rescan on the next pass of the outer loop
+
+                device_index = int(selection)
+                if 0 <= device_index < len(named_devices):
+                    return named_devices[device_index]
+                else:
+                    print("Invalid number, please try again.")
+            except ValueError:
+                print("Invalid input, please enter a number.")
+            except asyncio.CancelledError:
+                return None # Exit if the task is cancelled
+
+        # Drop the old list before scanning again so it can be collected
+        del named_devices
 
     return None
 
+# Returned by a command handler to end the interaction loop
+QUIT = object()
+
+def lookup_char(char_map: List[CharEntry], params: List[str]) -> Optional[BleakGATTCharacteristic]:
+    """Returns the characteristic numbered by the first parameter, or None if out of range."""
+    char_num = int(params[0])
+    return char_map[char_num][0] if 0 < char_num < len(char_map) else None
+
+async def cmd_help(client: BleakClient, char_map: List[CharEntry], params: List[str]):
+    """Prints the command summary."""
+    print(HELP_TEXT)
+
+async def cmd_list(client: BleakClient, char_map: List[CharEntry], params: List[str]):
+    """Reprints the numbered characteristics."""
+    print_char_map(char_map)
+
+async def cmd_quit(client: BleakClient, char_map: List[CharEntry], params: List[str]):
+    """Ends the interaction loop."""
+    return QUIT
+
+async def cmd_read(client: BleakClient, char_map: List[CharEntry], params: List[str]):
+    """Reads a characteristic and prints its value as hex and text."""
+    char = lookup_char(char_map, params)
+    if not char:
+        print("Invalid characteristic number.")
+        return
+
+    value = await client.read_gatt_char(char)
+    print(f"  Value: {value.hex()} | {value.decode(errors='ignore')}")
+
+async def cmd_write(client: BleakClient, char_map: List[CharEntry], params: List[str]):
+    """Parses a value and writes it to a characteristic."""
+    char = lookup_char(char_map, params)
+    if not char:
+        print("Invalid characteristic number.")
+        return
+    if len(params) < 2:
+        print("Write command needs a value.")
+        return
+
+    val_str = params[1]
+    try:
+        match val_str[:2]:
+            case '0x' | '0X':
+                data_to_write = bytes.fromhex(val_str[2:])
+            case "b'" | 'b"':
+                data_to_write = ast.literal_eval(val_str)
+                if not isinstance(data_to_write, bytes):
+                    raise ValueError("not a bytes literal")
+            case _:
+                data_to_write = val_str.encode('utf-8')
+    except (ValueError, SyntaxError) as e:
+        print(f"Invalid value: {e}")
+        return
+
+    await client.write_gatt_char(char, data_to_write)
+    print(f"  Wrote {data_to_write} to {char.uuid}")
+
+COMMAND_HANDLERS = {
+    'help': cmd_help,
+    'list': cmd_list,
+    'quit': cmd_quit,
+    'read': cmd_read,
+    'write': cmd_write,
+}
+
 async def explore_and_interact(device: BLEDevice, verbose: bool):
     """Connects to a device and provides a menu for GATT interaction."""
     print(f"\nConnecting to {device.name} ({device.address})...")
     
     try:
-        async with BleakClient(device) as client:
+        # Let the backend reuse its cached GATT database for devices it has seen before
+        # (BlueZ and WinRT) instead of rediscovering services on every connect
+        client = BleakClient(device, winrt={"use_cached_services": True})
+        await client.connect(dangerous_use_bleak_cache=True)
+        try:
             print(f"Connected. Type 'help' for commands.")
             
-            # Map characteristics to a number for easy interaction
-            char_map: Dict[int, object] = {}
-            current_char_index = 1
-            
-            for service in client.services:
-                # Filter for characteristics that are readable or writable
-                rw_chars = [c for c in service.characteristics if any(p in c.properties for p in ['read', 'write', 'write-without-response'])]
-                if rw_chars or verbose:
-                    print(f"\n[Service] {service.uuid}")
-                    for char in service.characteristics:
-                        props = ", ".join(char.properties)
-                        print(f"  {current_char_index}: {char.uuid} ({props})")
-                        char_map[current_char_index] = char
-                        current_char_index += 1
+            char_map = build_char_map(client.services, verbose)
 
             # Interaction loop
             while client.is_connected and not shutdown_event.is_set():
-                cmd_input = await asyncio.to_thread(input, "> ")
-                cmd, *params = cmd_input.split()
-
-                if cmd == 'help':
-                    print("Commands: read <num> | write <num> <value> | list | quit")
-                    print("  <value> can be text (e.g., 'hello') or hex (e.g., '0x01af')")
-                elif cmd == 'list':
-                    # This could be improved to re-print the service list
-                    print("Use the numbers listed above to interact with characteristics.")
-                elif cmd == 'quit':
-                    break
-                elif cmd in ['read', 'write']:
-                    try:
-                        char_num = int(params[0])
-                        char = char_map.get(char_num)
-                        if not char:
-                            print("Invalid characteristic number.")
-                            continue
-
-                        if cmd == 'read':
-                            value = await client.read_gatt_char(char.uuid)
-                            print(f"  Value: {value.hex()} | {value.decode(errors='ignore')}")
-                        elif cmd == 'write':
-                            if len(params) < 2:
-                                print("Write command needs a value.")
-                                continue
-                            
-                            val_str = params[1]
-                            if val_str.startswith("0x"):
-                                data_to_write = bytearray.fromhex(val_str[2:])
-                            else:
-                                data_to_write = val_str.encode('utf-8')
-                            
-                            await client.write_gatt_char(char.uuid, data_to_write)
-                            print(f"  Wrote {data_to_write} to {char.uuid}")
-
-                    except ValueError:
-                        print("Invalid number.")
-                    except Exception as e:
-                        print(f"An error occurred: {e}")
-                else:
+                cmd_input = await read_input("> ")
+                if not cmd_input.strip():
+                    continue
+                # At most cmd, num and value; the value keeps any spaces it contains
+                cmd, *params = cmd_input.split(None, 2)
+
+                handler = COMMAND_HANDLERS.get(cmd)
+                if handler is None:
                     print("Unknown command. Type 'help'.")
+                    continue
+
+                try:
+                    if await handler(client, char_map, params) is QUIT:
+                        break
+                except ValueError:
+                    print("Invalid number.")
+                except Exception as e:
+                    print(f"An error occurred: {e}")
+        finally:
+            await client.disconnect()
 
     except asyncio.CancelledError:
         print("Connection task cancelled.")
@@ -134,39 +239,41 @@ async def explore_and_interact(device: BLEDevice, verbose: bool):
     
     print("Disconnected.")
 
-async def main(args: argparse.Namespace, loop: asyncio.AbstractEventLoop):
+async def main(args: argparse.Namespace):
     """Main application orchestrator."""
-    while not shutdown_event.is_set():
-        device = await select_device(args.verbose)
-        if not device:
-            break # User chose to quit
-        
-        await explore_and_interact(device, args.verbose)
-        
-        # Ask if the user wants to connect to another device
-        if not shutdown_event.is_set():
-            res = await asyncio.to_thread(input, "\nConnect to another device? (y/n): ")
-            if res.lower() != 'y':
-                break
+    loop = asyncio.get_running_loop()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(sig, partial(_sched_shutdown, sig, loop))
+
+    # Own the main task so graceful_shutdown cancels it too
+    main_task = asyncio.current_task()
+    _owned_tasks.add(main_task)
+    main_task.add_done_callback(_owned_tasks.discard)
+
+    try:
+        while not shutdown_event.is_set():
+            device = await select_device(args.verbose)
+            if not device:
+                break # User chose to quit
+            
+            await explore_and_interact(device, args.verbose)
+            
+            # Ask if the user wants to connect to another device
+            if not shutdown_event.is_set():
+                res = await read_input("\nConnect to another device? (y/n): ")
+                if res.lower() != 'y':
+                    break
+    except asyncio.CancelledError:
+        pass # Cancelled by graceful_shutdown
 
     shutdown_event.set() # Signal all other parts to stop
-    # Small delay to ensure other tasks see the event before loop stops
-    await asyncio.sleep(0.1) 
-    if loop.is_running():
-        loop.stop()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="A simple, interactive BLE GATT tool.")
     parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output for more details.")
     args = parser.parse_args()
 
-    loop = asyncio.get_event_loop()
-    for sig in [signal.SIGINT, signal.SIGTERM]:
-        loop.add_signal_handler(sig, lambda s=sig: asyncio.create_task(graceful_shutdown(s, loop)))
-
     try:
-        main_task = asyncio.create_task(main(args, loop))
-        loop.run_forever()
+        get_runner()(main(args))
     finally:
         print("Application finished.")
-        loop.close()
@@ -0,0 +1,82 @@
+import asyncio
+import atexit
+import concurrent.futures
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional, TypeVar, Union
+from bleak import BleakScanner, BleakClient
+from bleak.backends.device import BLEDevice
+
+T = TypeVar("T")
+
+# A single reusable thread for blocking input() calls
+INPUT_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ble-input")
+atexit.register(INPUT_POOL.shutdown, wait=False)
+
+async def read_input(prompt: str) -> str:
+    """Runs blocking input() on the input thread without blocking the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(INPUT_POOL, input, prompt)
+
+def get_runner() -> Callable[[Coroutine[Any, Any, T]], T]:
+    """Returns uvloop.run when uvloop is installed, otherwise asyncio.run."""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run
+    return uvloop.run
+
+async def scan_for_name(name: str, timeout: float = 10.0) -> Optional[str]:
+    """Scans for a device called `name` and returns its address, or None if not seen in time."""
+    found = asyncio.Event()
+    address = None
+
+    def on_detect(device: BLEDevice, advertisement_data):
+        nonlocal address
+        if device.name == name and not found.is_set():
+            address = device.address
+            found.set()
+
+    # Stop as soon as the device advertises instead of waiting out the full timeout
+    async with BleakScanner(detection_callback=on_detect, scanning_mode="active"):
+        try:
+            await asyncio.wait_for(found.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    return address
+
+async def scan_and_list(timeout: float = 5.0, idle_timeout: float = 1.5) -> List[BLEDevice]:
+    """Scans until `timeout`, or until no new named device shows up for `idle_timeout`."""
+    found: Dict[str, BLEDevice] = {}
+    new_device = asyncio.Event()
+
+    def on_detect(device: BLEDevice, advertisement_data):
+        if not device.name:
+            return
+        if device.address not in found:
+            new_device.set()
+        found[device.address] = device
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with BleakScanner(detection_callback=on_detect, scanning_mode="active"):
+        while (remaining := deadline - loop.time()) > 0:
+            # Keep waiting the full period until the first device is seen
+            wait = min(remaining, idle_timeout) if found else remaining
+            try:
+                await asyncio.wait_for(new_device.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                if found:
+                    break
+            new_device.clear()
+
+    return list(found.values())
+
+async def with_connected_client(
+    address: Union[str, BLEDevice],
+    coro: Callable[[BleakClient], Awaitable[T]],
+    pair: bool = False,
+) -> T:
+    """Connects to `address`, awaits `coro(client)` and always disconnects afterwards."""
+    # pair= pairs before connecting where the backend supports it and is ignored on
+    # CoreBluetooth, where an explicit pair() call raises NotImplementedError
+    async with BleakClient(address, pair=pair) as client:
+        return await coro(client)
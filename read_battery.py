@@ -1,54 +1,70 @@
 import asyncio
 import argparse
-from bleak import BleakClient, BleakScanner, BleakError
+from functools import partial
+from bleak import BleakClient, BleakError
+from ble_utils import get_runner, read_input, scan_for_name, with_connected_client
 
 BATTERY_LEVEL_UUID = "00002a19-0000-1000-8000-00805f9b34fb"
 
-async def get_address_from_name(name):
-    print(f"Scanning for device named: {name}")
-    devices = await BleakScanner.discover(timeout=10)
-    for d in devices:
-        if d.name == name:
-            print(f"Found device: {d.name} @ {d.address}")
-            return d.address
-    print("Device not found")
-    return None
-
-async def main(address=None, name=None):
-    if not address and name:
-        address = await get_address_from_name(name)
-        if not address:
-            return
+async def read_battery_level(client: BleakClient):
+    try:
+        battery_level = await client.read_gatt_char(BATTERY_LEVEL_UUID)
+        print(f"Battery level: {battery_level[0]}%")
+    except (BleakError, asyncio.TimeoutError, OSError) as e:
+        # Transient failures are reported without dropping the connection
+        print(f"Failed to read battery level: {e}")
+
+async def poll_battery_level(client: BleakClient, retry: bool):
+    """Reads on every prompt over one connection; returns once the user is done."""
+    while True:
+        # Only pay for a new connection if the link actually dropped
+        if not client.is_connected:
+            try:
+                # The client was built with pair=True, so connect() pairs again as needed
+                await client.connect()
+            except Exception as e:
+                print(f"Reconnection failed: {e}")
+        if client.is_connected:
+            await read_battery_level(client)
+        if not retry:
+            break
+        command = await read_input("Command (q to quit): ")
+        if command.strip().lower() == 'q':
+            break
 
-    command = ''
-    while command != 'q':
+async def loop_read(address, retry=False):
+    while True:
         try:
-            client = BleakClient(address)
-            await client.connect(pair=True)
-            if client.is_connected:
-                try:
-                    battery_level = await client.read_gatt_char(BATTERY_LEVEL_UUID)
-                    print(f"Battery level: {int(battery_level[0])}%")
-                except BleakError as e:
-                    print(f"Failed to read battery level: {e}")
-            else:
-                print("Failed to connect to device.")
+            await with_connected_client(address, partial(poll_battery_level, retry=retry), pair=True)
+            return
         except Exception as e:
             print(f"Connection failed: {e}")
-        finally:
-            try:
-                await client.disconnect()
-            except Exception as e:
-                print(f"Disconnection error: {e}")
-        command = input("Command (q to quit): ").strip().lower()
+        # Let the user try the initial connection again, as for any other failure
+        if not retry:
+            return
+        command = await read_input("Command (q to quit): ")
+        if command.strip().lower() == 'q':
+            return
+
+async def main(address=None, name=None, retry=False):
+    if not address and name:
+        print(f"Scanning for device named: {name}")
+        address = await scan_for_name(name, timeout=10)
+        if not address:
+            print("Device not found")
+            return
+        print(f"Found device: {name} @ {address}")
+
+    await loop_read(address, retry=retry)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Get battery level from a BLE device")
     parser.add_argument("--address", type=str, help="Bluetooth address of the device")
     parser.add_argument("--name", type=str, help="Name of the device (e.g. 'Don’s iPhone')")
+    parser.add_argument("--once", action="store_true", help="Read the battery level once and exit")
     args = parser.parse_args()
 
     if not args.address and not args.name:
         print("Error: You must specify at least --address or --name")
     else:
-        asyncio.run(main(address=args.address, name=args.name))
+        get_runner()(main(address=args.address, name=args.name, retry=not args.once))